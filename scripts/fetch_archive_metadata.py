@@ -0,0 +1,692 @@
+#!/usr/bin/env python3
+"""Fill in audio front matter for radio show posts from Archive.org.
+
+Looks up the archive.org item referenced in a post, picks the best audio
+file on it, and writes audio_url / audio_length / audio_mime /
+itunes_duration into the post's front matter so the feed can build
+proper podcast enclosures.
+
+Usage:
+    python scripts/fetch_archive_metadata.py _posts/2021-07-04-radioshow.md
+    python scripts/fetch_archive_metadata.py --all --report report.json
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+try:
+    import urllib3
+except ImportError:
+    urllib3 = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+API_BASE = "https://archive.org/metadata/"
+DOWNLOAD_BASE = "https://archive.org/download/"
+USER_AGENT = "fetch-archive-metadata/1.0 (jimshreds.github.io)"
+
+# Every request goes to archive.org over HTTPS; a shared pool keeps the
+# sockets (and their TLS handshakes) alive across calls instead of paying
+# a fresh handshake per request like urlopen does.
+if urllib3 is not None:
+    _HTTP = urllib3.PoolManager(
+        num_pools=4, maxsize=16, headers={"User-Agent": USER_AGENT},
+        retries=False)
+else:
+    _HTTP = None
+
+_RETRYABLE = (HTTPError, URLError, OSError)
+if urllib3 is not None:
+    _RETRYABLE = _RETRYABLE + (urllib3.exceptions.HTTPError,)
+
+_ARETRYABLE = (asyncio.TimeoutError, OSError)
+if aiohttp is not None:
+    _ARETRYABLE = _ARETRYABLE + (aiohttp.ClientError,)
+if httpx is not None:
+    _ARETRYABLE = _ARETRYABLE + (httpx.HTTPError,)
+
+PREFERRED_EXTENSIONS = (".mp3", ".ogg", ".m4a")
+MIME_BY_EXT = {".mp3": "audio/mpeg", ".ogg": "audio/ogg", ".m4a": "audio/mp4"}
+
+# Keys a fully processed post carries; if they are all present we can skip
+# the network round-trip entirely on re-runs.
+TARGET_KEYS = frozenset({"audio_url", "audio_length", "audio_mime"})
+
+# re.ASCII keeps \w to [A-Za-z0-9_] here: archive.org identifiers are
+# ASCII, and the URL-safety shortcut below depends on it.
+_IDENT_RE = re.compile(r"archive\.org/(?:details|embed)/([\w\-\.]+)", re.ASCII)
+
+# The character class above only admits URL-safe characters, so anything
+# _IDENT_RE matched needs no percent-encoding.
+_SAFE_IDENT_RE = re.compile(r"[\w\-.]+\Z", re.ASCII)
+
+_print_lock = threading.Lock()
+
+
+def log(msg):
+    with _print_lock:
+        print(msg)
+
+
+def find_identifier(text):
+    """Pull the archive.org item identifier out of a post body."""
+    m = _IDENT_RE.search(text)
+    return m.group(1) if m else None
+
+
+def _quote_identifier(identifier):
+    """Percent-encode an identifier only when it actually needs it.
+
+    Identifiers found by _IDENT_RE never do; a hand-supplied --id might.
+    """
+    return identifier if _SAFE_IDENT_RE.match(identifier) else quote(identifier)
+
+
+def _backoff(attempt, base=0.5, cap=8.0):
+    """Decorrelated-jitter retry delay (AWS style).
+
+    Randomizing the delay keeps parallel workers from retrying a
+    rate-limited archive.org in lockstep.
+    """
+    return random.uniform(base, min(cap, base * 3 * (2 ** attempt)))
+
+
+def _retry_delay(exc, attempt):
+    """Seconds to sleep before retrying after exc.
+
+    Honors a server-sent Retry-After (urllib's HTTPError and aiohttp's
+    ClientResponseError both expose .headers) before falling back to
+    jittered backoff.
+    """
+    headers = getattr(exc, "headers", None)
+    if headers is None:
+        # httpx errors hang the headers off their response instead.
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+    retry_after = headers.get("Retry-After") if headers else None
+    if retry_after:
+        try:
+            return min(float(retry_after), 30.0)
+        except ValueError:
+            pass
+    return _backoff(attempt)
+
+
+def _want_file_row(f):
+    """Keep only rows pick_audio_file or the size lookup could use."""
+    name = (f.get("name") or "").lower()
+    ext = name.rsplit(".", 1)[-1] if "." in name else ""
+    return ext in _EXT_RANK or "audio" in (f.get("format") or "").lower()
+
+
+def _stream_files(resp):
+    """Stream-parse a metadata response down to its audio file rows.
+
+    The full response is often hundreds of KB of derivative rows and
+    checksums; ijson walks files[] incrementally so the rest is never
+    materialized.
+    """
+    return {"files": [f for f in ijson.items(resp, "files.item")
+                      if _want_file_row(f)]}
+
+
+def _get_json(url, timeout):
+    """GET a metadata URL and parse the JSON body.
+
+    Only files[] is ever consumed downstream, so with ijson installed the
+    response is stream-filtered to the audio rows instead of fully
+    parsed.
+    """
+    if _HTTP is not None:
+        if ijson is not None:
+            resp = _HTTP.request("GET", url, timeout=timeout,
+                                 preload_content=False)
+            try:
+                if resp.status >= 400:
+                    # Read off the error body first: releasing a
+                    # connection with unread data poisons the pool and
+                    # fails the next request that reuses the socket.
+                    resp.drain_conn()
+                    raise HTTPError(url, resp.status, "HTTP %d" % resp.status,
+                                    resp.headers, None)
+                return _stream_files(resp)
+            finally:
+                resp.release_conn()
+        resp = _HTTP.request("GET", url, timeout=timeout, preload_content=True)
+        if resp.status >= 400:
+            raise HTTPError(url, resp.status, "HTTP %d" % resp.status,
+                            resp.headers, None)
+        return json.loads(resp.data)
+    req = Request(url, headers={"User-Agent": USER_AGENT})
+    with urlopen(req, timeout=timeout) as resp:
+        if ijson is not None:
+            return _stream_files(resp)
+        return json.load(resp)
+
+
+def _head_headers(url, timeout):
+    """HEAD a URL and return its response headers."""
+    if _HTTP is not None:
+        resp = _HTTP.request("HEAD", url, timeout=timeout)
+        if resp.status >= 400:
+            raise HTTPError(url, resp.status, "HTTP %d" % resp.status,
+                            resp.headers, None)
+        return resp.headers
+    req = Request(url, method="HEAD", headers={"User-Agent": USER_AGENT})
+    with urlopen(req, timeout=timeout) as resp:
+        return resp.headers
+
+
+def _fetch_metadata(identifier, timeout=30, retries=3):
+    url = API_BASE + _quote_identifier(identifier)
+    for attempt in range(retries):
+        try:
+            return _get_json(url, timeout)
+        except _RETRYABLE as e:
+            if attempt == retries - 1:
+                raise
+            time.sleep(_retry_delay(e, attempt))
+
+
+# Multi-part show notes can point several posts at one item; memoize per
+# identifier so each item is fetched once per run, with a Future so that
+# concurrent duplicates coalesce onto the in-flight request.
+_meta_cache = {}
+_meta_lock = threading.Lock()
+
+
+def fetch_metadata(identifier, timeout=30, retries=3):
+    """Fetch the archive.org metadata JSON for an item (once per run)."""
+    with _meta_lock:
+        fut = _meta_cache.get(identifier)
+        first = fut is None
+        if first:
+            fut = concurrent.futures.Future()
+            _meta_cache[identifier] = fut
+    if first:
+        try:
+            fut.set_result(_fetch_metadata(identifier, timeout=timeout,
+                                           retries=retries))
+        except BaseException as e:
+            fut.set_exception(e)
+    return fut.result()
+
+
+@functools.lru_cache(maxsize=256)
+def head_content_length(url, timeout=30, retries=3):
+    """HEAD a download URL and return its Content-Length, if any."""
+    for attempt in range(retries):
+        try:
+            return _head_headers(url, timeout).get("Content-Length")
+        except _RETRYABLE as e:
+            if attempt == retries - 1:
+                raise
+            time.sleep(_retry_delay(e, attempt))
+
+
+_EXT_RANK = {ext.lstrip("."): rank
+             for rank, ext in enumerate(PREFERRED_EXTENSIONS)}
+
+
+def pick_audio_file(files):
+    """Pick the best audio file from an item's file list.
+
+    One pass over the (often 20+ entry) derivative list, ranking each
+    file once instead of rescanning the list per preferred extension.
+    """
+    best = None
+    best_rank = None
+    for f in files:
+        name = f.get("name", "")
+        ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+        rank = _EXT_RANK.get(ext)
+        if rank is None:
+            if "audio" not in f.get("format", "").lower():
+                continue
+            rank = len(PREFERRED_EXTENSIONS)
+        if best_rank is None or rank < best_rank:
+            best = f
+            best_rank = rank
+            if rank == 0:
+                break
+    return best
+
+
+def format_duration(length):
+    """Format an archive.org length value (seconds) as HH:MM:SS."""
+    try:
+        dur_sec = int(float(length))
+    except (TypeError, ValueError):
+        return str(length)
+    h, rem = divmod(dur_sec, 3600)
+    m, s = divmod(rem, 60)
+    return "%02d:%02d:%02d" % (h, m, s)
+
+
+def _split_front_matter(content):
+    """Locate the front matter block without scanning the body.
+
+    Returns (header, body_start); (None, -1) when there is no block.
+    """
+    if not content.startswith("---"):
+        return None, -1
+    end = content.find("\n---", 3)
+    if end == -1:
+        return None, -1
+    return content[4:end], end + 4
+
+
+def _parse_front_matter(content):
+    """Split a post into (kv, order, body).
+
+    Returns (None, None, None) when the text has no front matter block.
+    """
+    front, body_start = _split_front_matter(content)
+    if front is None:
+        return None, None, None
+    kv = {}
+    order = []
+    for line in front.splitlines():
+        if ":" in line:
+            key, _, value = line.partition(":")
+            key = key.strip()
+            if key not in kv:
+                order.append(key)
+            kv[key] = value.strip()
+    return kv, order, content[body_start:]
+
+
+def update_post_front_matter(post_path, updates, backup=True, content=None):
+    """Merge updates into a post's front matter, preserving key order.
+
+    content, when given, is the post's current text; passing it saves a
+    second read when the caller already loaded the file. Returns
+    "updated", "unchanged" (every value already matched, nothing
+    written), or False when the post has no front matter block.
+    """
+    p = Path(post_path)
+    if content is None:
+        content = p.read_text(encoding="utf-8")
+    kv, order, body = _parse_front_matter(content)
+    if kv is None:
+        return False
+    if all(kv.get(key) == str(value) for key, value in updates.items()):
+        return "unchanged"
+    for key, value in updates.items():
+        if key not in kv:
+            order.append(key)
+        kv[key] = str(value)
+    new_front = "\n".join("%s: %s" % (k, kv[k]) for k in order)
+    new_content = "---\n" + new_front + "\n---" + body
+    if new_content == content:
+        return "unchanged"
+    if backup:
+        bak = p.with_suffix(p.suffix + ".bak")
+        try:
+            # A hard link is an O(1) metadata op; the original bytes
+            # survive the rename below, so no copy is needed.
+            bak.unlink(missing_ok=True)
+            os.link(p, bak)
+        except OSError:
+            shutil.copyfile(p, bak)
+    tmp = p.with_suffix(p.suffix + ".tmp")
+    tmp.write_text(new_content, encoding="utf-8")
+    os.replace(tmp, p)
+    return "updated"
+
+
+def _updates_from_metadata(identifier, meta):
+    """Build the front-matter updates for an item.
+
+    Returns (updates, head_url): head_url is the download URL to HEAD for
+    audio_length when the file list did not report a size, else None.
+    """
+    audio_file = pick_audio_file(meta.get("files") or [])
+    if not audio_file:
+        return None, None
+    file_name = audio_file.get("name", "")
+    audio_url = (DOWNLOAD_BASE + _quote_identifier(identifier)
+                 + "/" + quote(file_name))
+    ext = "." + file_name.rsplit(".", 1)[-1].lower() if "." in file_name else ""
+    updates = {
+        "audio_url": audio_url,
+        "audio_mime": MIME_BY_EXT.get(ext, "audio/mpeg"),
+    }
+    size = audio_file.get("size")
+    if not size:
+        # Archive.org sometimes reports the size only on the original
+        # row; another entry with the same name is the same file.
+        size = next((f.get("size") for f in meta.get("files") or []
+                     if f.get("name") == file_name and f.get("size")), None)
+    if size:
+        updates["audio_length"] = str(size)
+    length = audio_file.get("length")
+    if length:
+        updates["itunes_duration"] = format_duration(length)
+    return updates, None if size else audio_url
+
+
+def _finish_post(result, post_path, identifier, updates, dry_run, backup,
+                 content=None):
+    """Write the updates (or report them for --dry-run) and fill in result."""
+    result["updates"] = updates
+    if dry_run:
+        result["ok"] = True
+        result["reason"] = "dry-run"
+        log("would update %s: %s" % (post_path, updates))
+        return result
+    status = update_post_front_matter(post_path, updates, backup=backup,
+                                      content=content)
+    if status == "unchanged":
+        # Leaving the mtime alone keeps Jekyll from rebuilding the post.
+        result["ok"] = True
+        result["reason"] = "unchanged"
+        log("no change %s" % post_path)
+    elif status:
+        result["ok"] = True
+        log("updated %s from item %s" % (post_path, identifier))
+    else:
+        result["reason"] = "no-front-matter"
+        log("fail %s: no front matter block" % post_path)
+    return result
+
+
+def process_post(post_path, identifier=None, timeout=30, retries=3,
+                 dry_run=False, backup=True, force=False,
+                 head_fallback=False):
+    """Look up one post's archive.org item and update its front matter."""
+    result = {"post": str(post_path), "ok": False}
+    text = Path(post_path).read_text(encoding="utf-8")
+    if not force:
+        kv, _, _ = _parse_front_matter(text)
+        if kv is not None and TARGET_KEYS <= kv.keys():
+            result["ok"] = True
+            result["reason"] = "already-populated"
+            log("skip %s: audio front matter already populated" % post_path)
+            return result
+    ident = identifier or find_identifier(text)
+    if not ident:
+        result["reason"] = "no-identifier"
+        log("skip %s: no archive.org link found" % post_path)
+        return result
+    result["identifier"] = ident
+
+    try:
+        meta = fetch_metadata(ident, timeout=timeout, retries=retries)
+    except Exception as e:
+        result["reason"] = "fetch-failed: %s" % e
+        log("fail %s: %s" % (post_path, e))
+        return result
+
+    updates, head_url = _updates_from_metadata(ident, meta)
+    if updates is None:
+        result["reason"] = "no-audio-file"
+        log("skip %s: no audio file on item %s" % (post_path, ident))
+        return result
+    if head_url and head_fallback:
+        try:
+            size = head_content_length(head_url, timeout=timeout,
+                                       retries=retries)
+        except Exception:
+            size = None
+        if size:
+            updates["audio_length"] = str(size)
+
+    return _finish_post(result, post_path, ident, updates, dry_run, backup,
+                        content=text)
+
+
+async def _afetch_metadata(session, identifier, timeout=30, retries=3):
+    url = API_BASE + _quote_identifier(identifier)
+    for attempt in range(retries):
+        try:
+            if httpx is not None and isinstance(session, httpx.AsyncClient):
+                resp = await session.get(url, timeout=timeout)
+                resp.raise_for_status()
+                return resp.json()
+            async with session.get(
+                    url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                resp.raise_for_status()
+                return await resp.json(content_type=None)
+        except _ARETRYABLE as e:
+            if attempt == retries - 1:
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt))
+
+
+_ameta_cache = {}
+
+
+async def afetch_metadata(session, identifier, timeout=30, retries=3):
+    """Async counterpart of fetch_metadata, driven by one ClientSession.
+
+    Memoized like the sync version; the event loop is single-threaded, so
+    a plain dict of futures is enough to coalesce duplicates.
+    """
+    fut = _ameta_cache.get(identifier)
+    if fut is not None:
+        return await fut
+    fut = asyncio.get_running_loop().create_future()
+    _ameta_cache[identifier] = fut
+    try:
+        fut.set_result(await _afetch_metadata(session, identifier,
+                                              timeout=timeout,
+                                              retries=retries))
+    except BaseException as e:
+        fut.set_exception(e)
+    # Awaiting our own future re-raises any failure and, crucially, marks
+    # the stored exception as retrieved even when no other post shares
+    # the identifier, so teardown stays free of "exception was never
+    # retrieved" noise.
+    return await fut
+
+
+async def ahead_content_length(session, url, timeout=30, retries=3):
+    """Async counterpart of head_content_length."""
+    for attempt in range(retries):
+        try:
+            if httpx is not None and isinstance(session, httpx.AsyncClient):
+                resp = await session.head(url, timeout=timeout)
+                resp.raise_for_status()
+                return resp.headers.get("Content-Length")
+            async with session.head(
+                    url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                resp.raise_for_status()
+                return resp.headers.get("Content-Length")
+        except _ARETRYABLE as e:
+            if attempt == retries - 1:
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt))
+
+
+async def aprocess_post(session, sem, post_path, identifier=None, timeout=30,
+                        retries=3, dry_run=False, backup=True, force=False,
+                        head_fallback=False):
+    """Async counterpart of process_post; sem bounds in-flight requests."""
+    result = {"post": str(post_path), "ok": False}
+    text = Path(post_path).read_text(encoding="utf-8")
+    if not force:
+        kv, _, _ = _parse_front_matter(text)
+        if kv is not None and TARGET_KEYS <= kv.keys():
+            result["ok"] = True
+            result["reason"] = "already-populated"
+            log("skip %s: audio front matter already populated" % post_path)
+            return result
+    ident = identifier or find_identifier(text)
+    if not ident:
+        result["reason"] = "no-identifier"
+        log("skip %s: no archive.org link found" % post_path)
+        return result
+    result["identifier"] = ident
+
+    async with sem:
+        try:
+            meta = await afetch_metadata(session, ident, timeout=timeout,
+                                         retries=retries)
+        except Exception as e:
+            result["reason"] = "fetch-failed: %s" % e
+            log("fail %s: %s" % (post_path, e))
+            return result
+
+        updates, head_url = _updates_from_metadata(ident, meta)
+        if updates is None:
+            result["reason"] = "no-audio-file"
+            log("skip %s: no audio file on item %s" % (post_path, ident))
+            return result
+        if head_url and head_fallback:
+            try:
+                size = await ahead_content_length(session, head_url,
+                                                  timeout=timeout,
+                                                  retries=retries)
+            except Exception:
+                size = None
+            if size:
+                updates["audio_length"] = str(size)
+
+    # File writes stay synchronous: they are tiny and hit disjoint paths.
+    return _finish_post(result, post_path, ident, updates, dry_run, backup,
+                        content=text)
+
+
+def _async_client():
+    """Build the async HTTP client, preferring HTTP/2 where possible.
+
+    Everything here talks to one host, so with httpx (plus the h2 extra)
+    a single multiplexed connection carries every in-flight request and
+    pays exactly one TLS handshake per run; aiohttp's socket pool is the
+    fallback.
+    """
+    if httpx is not None:
+        try:
+            return httpx.AsyncClient(
+                http2=True, headers={"User-Agent": USER_AGENT},
+                limits=httpx.Limits(max_connections=8,
+                                    max_keepalive_connections=8))
+        except ImportError:  # httpx without the h2 extra
+            return httpx.AsyncClient(headers={"User-Agent": USER_AGENT})
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=32),
+                                 headers={"User-Agent": USER_AGENT})
+
+
+async def _run_async(targets, args):
+    """Drive every target over one shared connection pool."""
+    sem = asyncio.Semaphore(args.workers)
+    async with _async_client() as session:
+        return await asyncio.gather(*(
+            aprocess_post(session, sem, t,
+                          identifier=None if args.all else args.id,
+                          timeout=args.timeout, retries=args.retries,
+                          dry_run=args.dry_run, backup=not args.no_backup,
+                          force=args.force,
+                          head_fallback=args.head_fallback)
+            for t in targets))
+
+
+def find_radioshow_posts(posts_dir="_posts"):
+    """Return every radio show post path, oldest first."""
+    with os.scandir(posts_dir) as it:
+        return sorted(f.path for f in it
+                      if f.name.endswith("radioshow.md") and f.is_file())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fill in audio front matter from Archive.org metadata.")
+    parser.add_argument("post", nargs="?", help="path to a single post")
+    parser.add_argument("--all", action="store_true",
+                        help="process every *radioshow.md post in _posts/")
+    parser.add_argument("--id", help="archive.org identifier override")
+    parser.add_argument("--timeout", type=int, default=30,
+                        help="per-request timeout in seconds")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="attempts per request")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="parallel fetches for --all")
+    parser.add_argument("--head-fallback", action="store_true",
+                        help="HEAD the download URL for audio_length when "
+                             "the file list has no size")
+    parser.add_argument("--force", action="store_true",
+                        help="refetch even when the audio keys are already "
+                             "filled in")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report what would change without writing")
+    parser.add_argument("--no-backup", action="store_true",
+                        help="skip writing .bak files")
+    parser.add_argument("--report", help="write a JSON report to this path; "
+                        "a .ndjson suffix writes one JSON object per line")
+    parser.add_argument("--report-compact", action="store_true",
+                        help="write the report without indentation")
+    args = parser.parse_args(argv)
+
+    if args.all:
+        targets = find_radioshow_posts()
+    elif args.post:
+        targets = [args.post]
+    else:
+        parser.error("give a post path or --all")
+    if not targets:
+        log("nothing to do")
+        return 0
+
+    if (aiohttp is not None or httpx is not None) and len(targets) > 1:
+        # One event loop and one connection pool scale further than a
+        # thread per in-flight request; the semaphore caps concurrency.
+        report = asyncio.run(_run_async(targets, args))
+    else:
+        worker = functools.partial(
+            process_post,
+            identifier=None if args.all else args.id,
+            timeout=args.timeout,
+            retries=args.retries,
+            dry_run=args.dry_run,
+            backup=not args.no_backup,
+            force=args.force,
+            head_fallback=args.head_fallback,
+        )
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=args.workers) as pool:
+            report = list(pool.map(worker, targets))
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as fh:
+            if args.report.endswith(".ndjson"):
+                # One object per line: nothing ever holds the whole
+                # serialized report in memory, and it greps nicely.
+                for res in report:
+                    fh.write(json.dumps(res) + "\n")
+            elif args.report_compact:
+                json.dump(report, fh)
+            else:
+                json.dump(report, fh, indent=2)
+
+    return 0 if all(r["ok"] for r in report) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())